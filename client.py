@@ -1,72 +1,209 @@
 import socket  # Import socket module for network communication
+import sys  # Import sys module to write whole listings to stdout at once
 import json  # Import json module for data serialization/deserialization
+import struct  # Import struct module for the message length prefix
+import time  # Import time module for cache expiry timestamps
+try:
+    import readline  # Gives input() line editing and history where available
+except ImportError:  # Not available on Windows
+    pass
 
 # Server connection configuration
 HOST = "127.0.0.1"  # Localhost IP address
 PORT = 12345  # Port number for the connection
+FRAME_HEADER = struct.Struct(">I")  # Every message is prefixed with its length as a 4-byte big-endian integer
+MAX_FRAME_SIZE = 64 << 20  # Largest response accepted (64 MB), so a corrupt length can't exhaust memory
 
-# Create a socket object for TCP communication
-client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-client.connect((HOST, PORT))  # Connect to the server at the specified host and port
+def _make_socket():
+    """
+    Creates a TCP socket tuned for small request/response messages and connects it to the server.
+    
+    Returns:
+        socket.socket: The connected client socket
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)  # Create a socket object for TCP communication
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # Disable Nagle so small requests are sent immediately
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)  # Detect a dead server while idling at a menu prompt
+    sock.connect((HOST, PORT))  # Connect to the server at the specified host and port
+    # Linux only: a one-shot hint to leave quick-ack mode on for now. The kernel can fall back to
+    # delayed ACKs later, so this only helps the first replies, not the whole connection.
+    if hasattr(socket, "TCP_QUICKACK"):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+    return sock
+
+def _open_reader(sock):
+    """
+    Wraps a connected socket in a persistent buffered reader for framed responses.
+    
+    Args:
+        sock (socket.socket): The connected client socket
+        
+    Returns:
+        io.BufferedReader: Reader for the socket
+    """
+    return sock.makefile('rb', buffering=65536)  # Large read buffer so most responses arrive in one read
+
+# Reusable JSON encoder with compact separators (no spaces) to keep request payloads small;
+# requests never contain cycles, so the circular-reference check is skipped
+_json_encoder = json.JSONEncoder(separators=(",", ":"), check_circular=False)
+
+def _connect():
+    """
+    Opens a new connection to the server and rebinds the global socket and its reader.
+    """
+    global client, reader
+    client = _make_socket()
+    reader = _open_reader(client)  # Reused for every response on this connection
+
+# Create the client socket and reader used for all requests
+_connect()
 
 # Global variables to store user information
 user_id = None  # User ID received from server after login
 points = 0  # Points balance for the current user
 
-def send_request(action, data={}):
+# Events table layout shared by view_events() and purchase_ticket()
+_EVENTS_HEADER = "ID | Concert Name | Regular Tickets | VIP Tickets | Regular Cost | VIP Cost"
+_EVENTS_SEP = "-" * 80
+_EVENT_ROW = "{id} | {name} | {available_tickets} | {vip_tickets} | {regular_cost} points | {vip_cost} points"
+
+# Short-lived cache of the last successful view_events response
+_events_cache = {"data": None, "ts": 0.0}
+
+# Receive buffers reused for every response: the fixed-size length prefix and a body buffer
+# that only grows when a response is larger than any seen before
+_header_buf = bytearray(FRAME_HEADER.size)
+_body_buf = bytearray(65536)
+
+def _body_view(length):
+    """
+    Returns a writable view of exactly `length` bytes of the reusable body buffer.
+    
+    Args:
+        length (int): Size of the response body
+        
+    Returns:
+        memoryview: View over the start of the body buffer
+    """
+    global _body_buf
+    if length > len(_body_buf):
+        _body_buf = bytearray(length)  # Grow to fit; kept for later responses
+    return memoryview(_body_buf)[:length]
+
+def send_request(action, data=None):
     """
     Sends a request to the server and returns the response.
     
     Args:
         action (str): The action to perform (e.g. 'login', 'register')
-        data (dict): Additional data for the request
+        data (dict, optional): Additional data for the request
         
     Returns:
         dict: The server's response parsed from JSON
     """
-    global client  # Use global client socket
+    # Create request dictionary with action and any additional data in one step
+    request = {"action": action, **data} if data else {"action": action}
+    return _exchange(request)
+
+def send_batch(requests):
+    """
+    Sends several requests in one message and returns their responses in the same order.
+    
+    Args:
+        requests (list): Up to 8 request dictionaries, each with a read-only 'action'
+            (check_points, view_events or view_purchases)
+        
+    Returns:
+        list: The server's responses, one per request
+    """
+    response = _exchange({"action": "batch", "items": requests})
+    if isinstance(response, dict):  # The server rejected the batch as a whole
+        raise Exception(response.get("message", "Batch request failed"))
+    return response
+
+def _exchange(request):
+    """
+    Writes one framed request to the server and reads back one framed response.
+    
+    Args:
+        request (dict): The request to send
+        
+    Returns:
+        dict or list: The server's response parsed from JSON
+    """
     try:
-        request = {"action": action}  # Create request dictionary with action
-        request.update(data)  # Add additional data to the request
+        payload = _json_encoder.encode(request).encode()
         
-        # Check if socket is still connected
+        # Build the framed request as one buffer (length prefix marks the message boundary)
+        # so it goes out in a single segment; sendall retries until every byte is written
+        frame = FRAME_HEADER.pack(len(payload)) + payload
         try:
-            client.send(json.dumps(request).encode())  # Convert to JSON, encode to bytes, and send
+            client.sendall(frame)
         except (BrokenPipeError, ConnectionResetError, ConnectionAbortedError):
             # Reconnect if connection is lost
             print("Connection lost. Attempting to reconnect...")
-            client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            client.connect((HOST, PORT))
-            client.send(json.dumps(request).encode())
+            _connect()
+            client.sendall(frame)
         
-        # Receive response in chunks until complete
-        chunks = []
-        while True:
-            try:
-                chunk = client.recv(4096).decode()  # Receive chunk (4096 bytes buffer), decode from bytes
-                if not chunk:
-                    break
-                chunks.append(chunk)
-                if chunk.endswith('\n'):  # If we received a complete message
-                    break
-            except (BrokenPipeError, ConnectionResetError, ConnectionAbortedError):
-                print("Connection lost while receiving response.")
-                raise Exception("Connection lost while receiving response")
+        # Receive exactly one length-prefixed response into the reusable buffers
+        try:
+            if reader.readinto(_header_buf) < FRAME_HEADER.size:  # Length of the response body
+                raise Exception("No response received from server")
+            (length,) = FRAME_HEADER.unpack(_header_buf)
+            if length > MAX_FRAME_SIZE:
+                raise Exception("Response too large")
+            body = _body_view(length)
+            received = reader.readinto(body)  # Fill the buffer in place, no per-response bytes object
+        except (BrokenPipeError, ConnectionResetError, ConnectionAbortedError):
+            print("Connection lost while receiving response.")
+            raise Exception("Connection lost while receiving response")
         
-        response_data = ''.join(chunks)  # Combine all chunks
-        if not response_data:
-            raise Exception("No response received from server")
-            
-        response = json.loads(response_data)  # Parse JSON response into a dictionary
+        if received < length:
+            raise Exception("Connection lost while receiving response")
+        
+        response_text = str(body, "utf-8")  # Decode the complete body once
+        response = json.loads(response_text)  # Parse JSON response into a dictionary
         return response  # Return the parsed response
     except json.JSONDecodeError as e:
         print(f"Error decoding server response: {e}")
-        print(f"Raw response: {response_data}")
+        print(f"Raw response: {response_text}")
         raise
     except Exception as e:
         print(f"Error in send_request: {e}")
         raise
 
+def _get_events(max_age=2.0):
+    """
+    Returns the events list, reusing a recent response instead of asking the server again.
+    
+    Args:
+        max_age (float): Maximum age in seconds of a cached response before it is refetched
+        
+    Returns:
+        dict: The server's view_events response
+    """
+    now = time.monotonic()
+    if _events_cache["data"] is not None and now - _events_cache["ts"] < max_age:
+        return _events_cache["data"]  # Fresh enough, skip the round-trip
+    response = send_request("view_events")
+    if response["status"] == "success":  # Only cache successful responses
+        _events_cache.update(data=response, ts=now)
+    return response
+
+def _format_events(events):
+    """
+    Formats the events table (header, separator and one row per event) as a single string.
+    
+    Args:
+        events (list): Event dictionaries from a view_events response
+        
+    Returns:
+        str: The formatted table, ending with a blank line
+    """
+    lines = [_EVENTS_HEADER, _EVENTS_SEP]
+    lines.extend(_EVENT_ROW.format_map(event) for event in events)
+    return "\n".join(lines) + "\n\n"
+
 def login():
     """
     Handles the user login process.
@@ -117,13 +254,9 @@ def purchase_ticket():
     
     # Show available concerts first
     print("\nAvailable Concerts:")
-    response = send_request("view_events")
+    response = _get_events()
     if response["status"] == "success":
-        print("ID | Concert Name | Regular Tickets | VIP Tickets | Regular Cost | VIP Cost")
-        print("-" * 80)
-        for event in response["events"]:
-            print(f"{event['id']} | {event['name']} | {event['available_tickets']} | {event['vip_tickets']} | {event['regular_cost']} points | {event['vip_cost']} points")
-        print()
+        sys.stdout.write(_format_events(response["events"]))  # Write the whole table at once
     else:
         print("Error viewing events:", response.get("message", "Unknown error"))
         return
@@ -140,7 +273,21 @@ def purchase_ticket():
     print(response["message"])  # Display response message from server
     
     if response["status"] == "success":  # Check if purchase was successful
-        # Update points after purchase
+        _events_cache["data"] = None  # Ticket counts changed, drop the cached events list
+        _update_points(response)  # Update points after purchase
+
+def _update_points(response):
+    """
+    Updates the points balance from a response that carries it, falling back to check_points().
+    
+    Args:
+        response (dict): A successful server response
+    """
+    global points  # Use global points variable so we can modify it
+    if "points" in response:  # Server already sent the new balance, no extra round-trip needed
+        points = response["points"]
+        print(f"You have {points} points.")  # Display current points balance
+    else:
         check_points()  # Refresh points balance from server
 
 def check_points():
@@ -157,22 +304,19 @@ def check_points():
     if response["status"] == "success":  # Check if request was successful
         points = response["points"]  # Update points with value from server
         print(f"You have {points} points.")  # Display current points balance
+    else:
+        print(response["message"])  # Display error message from server
 
 def view_events():
     """
     Retrieves and displays all available events.
     """
     try:
-        # Send request to get list of events
-        response = send_request("view_events")
+        # Get list of events (may be served from the short-lived cache)
+        response = _get_events()
         if response["status"] == "success":  # Check if request was successful
-            print("\nAvailable Events:")  # Print header
-            print("ID | Event Name | Regular Tickets | VIP Tickets | Regular Cost | VIP Cost")  # Print column headers
-            print("-" * 80)  # Print separator line
-            for event in response["events"]:  # Iterate through each event in the response
-                # Print event details in a formatted way
-                print(f"{event['id']} | {event['name']} | {event['available_tickets']} | {event['vip_tickets']} | {event['regular_cost']} points | {event['vip_cost']} points")
-            print()  # Print blank line after events list
+            # Build the title and events table in memory and write it with a single call
+            sys.stdout.write("\nAvailable Events:\n" + _format_events(response["events"]))
         else:
             print("Error viewing events:", response.get("message", "Unknown error"))
     except json.JSONDecodeError:
@@ -189,26 +333,23 @@ def add_funds():
         print("Please login first.")  # Inform user login is required
         return
         
+    amount = input("Enter amount to add: ")  # Prompt for amount to add
     try:
-        amount = input("Enter amount to add: ")  # Prompt for amount to add
-        
-        # VULNERABILITY: COMMAND INJECTION - Using eval() on user input
-        # This allows attackers to execute arbitrary Python code
-        # Example attack: amount = "__import__('os').system('rm -rf /')" would delete files
-        amount = eval(amount)
-        
-        if amount <= 0:
-            print("Amount must be greater than 0.")
-            return
-            
-        # Send request to add funds
-        response = send_request("add_funds", {"userid": user_id, "amount": amount})
-        print(response["message"])  # Display response message from server
-        
-        if response["status"] == "success":  # Check if request was successful
-            check_points()  # Refresh points balance from server
+        amount = int(amount)  # Parse as a whole number of points (never eval user input)
     except ValueError:
         print("Please enter a valid number.")
+        return
+    
+    if amount <= 0:
+        print("Amount must be greater than 0.")
+        return
+        
+    # Send request to add funds
+    response = send_request("add_funds", {"userid": user_id, "amount": amount})
+    print(response["message"])  # Display response message from server
+    
+    if response["status"] == "success":  # Check if request was successful
+        _update_points(response)  # Update points from the response
 
 def view_purchases():
     """
@@ -229,17 +370,18 @@ def view_purchases():
                 print("\nNo purchase history found.")
                 return
                 
-            print("\nPurchase History:")
+            # Build the whole history in memory and write it with a single call
+            lines = ["\nPurchase History:"]
             for purchase in purchases:
-                print(f"Purchase ID: {purchase[0]}")
                 try:
-                    # The event name is now in the 'event_name' position (index 4)
-                    print(f"Event: {purchase[4]}")
-                    print(f"Ticket Type: {purchase[2]}")
-                    print(f"Purchase Date: {purchase[3]}")
-                except IndexError:
-                    print(f"Error: Invalid purchase data format: {purchase}")
-                print("-" * 50)
+                    lines.append(f"Purchase ID: {purchase['id']}")
+                    lines.append(f"Event: {purchase['event_name']}")
+                    lines.append(f"Ticket Type: {purchase['ticket_type']}")
+                    lines.append(f"Purchase Date: {purchase['purchase_date']}")
+                except (KeyError, TypeError):
+                    lines.append(f"Error: Invalid purchase data format: {purchase}")
+                lines.append("-" * 50)
+            sys.stdout.write("\n".join(lines) + "\n")
         else:
             print(f"\nError viewing purchases: {response.get('message', 'Unknown error')}")
     except Exception as e:
@@ -253,10 +395,8 @@ def reconnect_to_server():
     Returns:
         bool: True if reconnection was successful, False otherwise
     """
-    global client
     try:
-        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        client.connect((HOST, PORT))
+        _connect()
         print("Reconnected to server successfully.")
         return True
     except Exception as e:
@@ -300,62 +440,74 @@ def diagnose_db():
     except Exception as e:
         print(f"Error running diagnostics: {str(e)}")
 
+# Main menu choices that map directly to a handler (logout and exit are handled in main)
+MENU_HANDLERS = {
+    "1": view_events,  # Display events
+    "2": purchase_ticket,  # Process ticket purchase
+    "3": check_points,  # Display points balance
+    "5": add_funds,  # Process add funds
+    "6": view_purchases,  # Display purchase history
+}
+
+def pre_login_menu():
+    """
+    Shows the login menu once and handles the user's choice.
+    
+    Returns:
+        bool: False if the user chose to exit, True otherwise
+    """
+    print("\n1. Login | 2. Register | 3. Exit")  # Display pre-login menu
+    choice = input("> ")  # Get user choice
+    if choice == "1":  # User chose login
+        login()  # Attempt login (sets user_id and points on success)
+    elif choice == "2":  # User chose register
+        register()  # Attempt registration
+    elif choice == "3":  # User chose exit
+        return False
+    else:
+        print("Invalid choice.")  # Inform user of invalid selection
+    return True
+
+def post_login_menu():
+    """
+    Shows the main menu once and handles the user's choice.
+    
+    Returns:
+        bool: False if the user chose to exit (or the connection can't be restored), True otherwise
+    """
+    global user_id  # Use global user_id variable
+    print("\n1. View Events | 2. Buy Ticket | 3. Check Points | 4. Logout | 5. Add Funds | 6. View Purchases | 7. Exit")  # Display main menu
+    choice = input("> ")  # Get user choice
+    handler = MENU_HANDLERS.get(choice)  # Look up the handler for this choice
+    try:
+        if handler:
+            handler()  # Run the selected action
+        elif choice == "4":  # User chose logout
+            user_id = None  # Clear user_id to indicate logout; main() switches back to the login menu
+            print("Logged out successfully.")  # Display logout confirmation
+        elif choice == "7":  # User chose exit
+            return False
+        else:
+            print("Invalid choice.")  # Inform user of invalid selection
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        print("Attempting to reconnect to server...")
+        if not reconnect_to_server():
+            print("Failed to reconnect. Please restart the application.")
+            return False
+    return True
+
 def main():
     """
     Main function that handles the user interface flow.
+    Runs one loop with two states: the login menu while logged out, the main menu while logged in.
     """
-    global user_id  # Use global user_id variable
     print("Welcome to Otaku Concerts!")  # Display welcome message
-    
-    # Login/Registration loop
     while True:
-        if user_id is None:  # Check if user is not logged in
-            print("\n1. Login | 2. Register | 3. Exit")  # Display pre-login menu
-            choice = input("> ")  # Get user choice
-            if choice == "1":  # User chose login
-                if login():  # Attempt login
-                    break  # Proceed to main menu after successful login
-            elif choice == "2":  # User chose register
-                register()  # Attempt registration
-            elif choice == "3":  # User chose exit
-                print("Goodbye!")  # Display exit message
-                return  # Exit the program
-            else:
-                print("Invalid choice.")  # Inform user of invalid selection
-        else:
-            break  # User is already logged in, skip to main menu
-    
-    # Main menu loop (after login)
-    while user_id is not None:  # Loop while user is logged in
-        print("\n1. View Events | 2. Buy Ticket | 3. Check Points | 4. Logout | 5. Add Funds | 6. View Purchases | 7. Exit")  # Display main menu
-        choice = input("> ")  # Get user choice
-        try:
-            if choice == "1":  # User chose view events
-                view_events()  # Display events
-            elif choice == "2":  # User chose buy ticket
-                purchase_ticket()  # Process ticket purchase
-            elif choice == "3":  # User chose check points
-                check_points()  # Display points balance
-            elif choice == "4":  # User chose logout
-                user_id = None  # Clear user_id to indicate logout
-                print("Logged out successfully.")  # Display logout confirmation
-                main()  # Restart the login flow
-                return  # Return from current main() call (prevents stacking)
-            elif choice == "5":  # User chose add funds
-                add_funds()  # Process add funds
-            elif choice == "6":  # User chose view purchases
-                view_purchases()  # Display purchase history
-            elif choice == "7":  # User chose exit
-                print("Goodbye!")  # Display exit message
-                break  # Exit the loop
-            else:
-                print("Invalid choice.")  # Inform user of invalid selection
-        except Exception as e:
-            print(f"An error occurred: {e}")
-            print("Attempting to reconnect to server...")
-            if not reconnect_to_server():
-                print("Failed to reconnect. Please restart the application.")
-                break
+        menu = pre_login_menu if user_id is None else post_login_menu  # Pick the menu for the current state
+        if not menu():
+            break
+    print("Goodbye!")  # Display exit message
 
 if __name__ == "__main__":  # Check if this file is being run directly
     try:
@@ -1,37 +1,148 @@
 import sqlite3  # Import SQLite database module for data storage
-import socket  # Import socket module for network communication
+import hashlib  # Import hashlib module for scrypt password hashing
+import hmac  # Import hmac module for constant-time hash comparison
+import os  # Import os module for random password salts
+import asyncio  # Import asyncio module to serve many client connections on one event loop
 import json  # Import json module for data serialization/deserialization
-import threading  # Import threading module to handle multiple client connections
+import logging  # Import logging module for server diagnostics
+import socket  # Import socket module for TCP socket options
+import struct  # Import struct module for the message length prefix
+import threading  # Import threading module for per-thread database connections
+import queue  # Import queue module to hand writes to the group-commit writer thread
+import time  # Import time module for the group-commit window and login cache expiry
+from concurrent.futures import Future, ThreadPoolExecutor  # Import executor to run blocking SQLite calls off the event loop
+
+# SQL used while serving requests, kept as module constants so every call passes the same
+# string and hits sqlite3's prepared-statement cache instead of re-parsing the query
+SQL_LOGIN = "SELECT id, points, password FROM users WHERE username = ?"
+SQL_REGISTER = "INSERT INTO users (username, password) VALUES (?, ?)"
+SQL_SET_PASSWORD = "UPDATE users SET password = ? WHERE id = ?"
+SQL_VIEW_EVENTS = "SELECT id, name, available_tickets, vip_tickets, regular_cost, vip_cost FROM events"
+SQL_USER_POINTS = "SELECT points FROM users WHERE id = ?"
+SQL_TAKE_REGULAR_TICKET = "UPDATE events SET available_tickets = available_tickets - 1 WHERE id = ? AND available_tickets > 0 RETURNING regular_cost, available_tickets"
+SQL_TAKE_VIP_TICKET = "UPDATE events SET vip_tickets = vip_tickets - 1 WHERE id = ? AND vip_tickets > 0 RETURNING vip_cost, vip_tickets"
+# Charge for a ticket in one statement: the price gets a 10% discount (rounded down) once the user
+# has bought 3 or more tickets, and the user is only charged if they can afford it. The user's
+# purchase count is kept on their row and bumped by the same UPDATE, so no purchases are counted.
+# SET and WHERE see the row before the update; RETURNING sees it after (hence purchases_count - 1).
+SQL_CHARGE_USER = """
+    UPDATE users
+    SET points = points - CASE WHEN purchases_count >= 3 THEN :base_cost * 9 / 10 ELSE :base_cost END,
+        purchases_count = purchases_count + 1
+    WHERE id = :user_id
+      AND points >= CASE WHEN purchases_count >= 3 THEN :base_cost * 9 / 10 ELSE :base_cost END
+    RETURNING points, CASE WHEN purchases_count - 1 >= 3 THEN :base_cost * 9 / 10 ELSE :base_cost END
+"""
+SQL_ADD_POINTS = "UPDATE users SET points = points + ? WHERE id = ? RETURNING points"
+SQL_RECORD_PURCHASE = "INSERT INTO purchases (user_id, event_id, ticket_type) VALUES (?, ?, ?)"
+SQL_USER_EXISTS = "SELECT id FROM users WHERE id = ?"
+SQL_TABLE_EXISTS = "SELECT name FROM sqlite_master WHERE type='table' AND name = ?"
+# A user's purchases, newest first; LEFT JOIN keeps purchases whose event has been deleted
+SQL_USER_PURCHASES = """
+    SELECT p.id, p.event_id, p.ticket_type, p.purchase_date,
+           COALESCE(e.name, 'Unknown Event') as event_name
+    FROM purchases p
+    LEFT JOIN events e ON p.event_id = e.id
+    WHERE p.user_id = ?
+    ORDER BY p.id DESC
+"""
+SQL_SAMPLE_USER = "SELECT id FROM users LIMIT 1"
+SQL_FOREIGN_KEYS = "PRAGMA foreign_keys"
+# Per-table statements for diagnose_db (table names can't be bound as parameters)
+DIAGNOSE_TABLES = ("users", "events", "purchases")
+SQL_COUNT_ROWS = {table: f"SELECT COUNT(*) FROM {table}" for table in DIAGNOSE_TABLES}
+SQL_TABLE_INFO = {table: f"PRAGMA table_info({table})" for table in DIAGNOSE_TABLES}
+
+# Server log: startup and errors at INFO and above; per-request details at DEBUG, which costs
+# nothing unless enabled (e.g. logging.getLogger("server").setLevel(logging.DEBUG))
+logging.basicConfig(format="%(asctime)s %(levelname)s %(message)s")
+log = logging.getLogger("server")
+log.setLevel(logging.INFO)
 
 # Database setup
-conn = sqlite3.connect("ticket_system.db", check_same_thread=False)  # Connect to SQLite database, allow access from multiple threads
+DB_PATH = "ticket_system.db"  # SQLite database file
+
+def open_db(read_only=False):
+    """
+    Open a new database connection with the settings every server connection uses.
+    
+    Args:
+        read_only: Open the database read-only (for connections that only run queries)
+        
+    Returns:
+        sqlite3.Connection: The configured connection
+    """
+    # isolation_level=None: the sqlite3 module never opens transactions on its own; every
+    # transaction is started with an explicit BEGIN and ended with COMMIT/ROLLBACK
+    if read_only:
+        # SQLite itself rejects any write on this connection
+        db = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True, isolation_level=None, cached_statements=256)
+    else:
+        # Connect to SQLite database, cache prepared statements
+        db = sqlite3.connect(DB_PATH, isolation_level=None, cached_statements=256)
+        # Tune SQLite for many small transactions: WAL lets readers run alongside the writer and
+        # synchronous=NORMAL avoids an fsync on every commit (still safe in WAL mode).
+        # page_size only applies when the database file is first created (so it comes before
+        # journal_mode, which writes the header); 4096 matches the OS page for memory-mapped reads.
+        db.executescript("""
+            PRAGMA page_size = 4096;
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+        """)
+    db.executescript("""
+        PRAGMA temp_store = MEMORY;
+        PRAGMA mmap_size = 268435456;
+        PRAGMA cache_size = -65536;
+    """)
+    db.execute("PRAGMA foreign_keys = ON")  # Enable foreign keys (a per-connection setting)
+    db.row_factory = sqlite3.Row  # Rows support access by column name as well as by index
+    return db
+
+# Connection used by the main thread for startup checks and seeding
+conn = open_db()
 cursor = conn.cursor()  # Create a cursor object to execute SQL commands
 
-# Enable foreign keys
-cursor.execute("PRAGMA foreign_keys = ON")
+# Each database worker thread lazily opens its own read-only connection, so threads never share
+# a connection or cursor and queries run in parallel under WAL. All writes go through the single
+# writer thread (see run_write), which owns the only read-write connection while serving.
+db_local = threading.local()
+
+def get_cursor():
+    """
+    Return the calling thread's read-only cursor, opening the thread's connection on first use.
+    
+    Returns:
+        sqlite3.Cursor: Cursor on this thread's own connection
+    """
+    thread_cursor = getattr(db_local, "cursor", None)
+    if thread_cursor is None:
+        thread_cursor = db_local.cursor = open_db(read_only=True).cursor()
+    return thread_cursor
 
 # Function to verify database integrity
 def verify_database_integrity():
     """Verifies that all tables exist with the correct schema and repairs if needed."""
-    print("Verifying database integrity...")
+    log.info("Verifying database integrity...")
+    cursor.execute("BEGIN")  # Make every repair below part of one transaction, committed once at the end
     
     # Check if users table exists
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='users'")
+    cursor.execute(SQL_TABLE_EXISTS, ("users",))
     if not cursor.fetchone():
-        print("Creating users table...")
+        log.info("Creating users table...")
         cursor.execute("""
             CREATE TABLE users (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 username TEXT UNIQUE,
                 password TEXT,
-                points INTEGER DEFAULT 100
+                points INTEGER DEFAULT 100,
+                purchases_count INTEGER NOT NULL DEFAULT 0
             )
         """)
         
     # Check if events table exists
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='events'")
+    cursor.execute(SQL_TABLE_EXISTS, ("events",))
     if not cursor.fetchone():
-        print("Creating events table...")
+        log.info("Creating events table...")
         cursor.execute("""
             CREATE TABLE events (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -44,9 +155,9 @@ def verify_database_integrity():
         """)
         
     # Check if purchases table exists
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='purchases'")
+    cursor.execute(SQL_TABLE_EXISTS, ("purchases",))
     if not cursor.fetchone():
-        print("Creating purchases table...")
+        log.info("Creating purchases table...")
         cursor.execute("""
             CREATE TABLE purchases (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -59,9 +170,16 @@ def verify_database_integrity():
             )
         """)
     
+    # Databases created before users.purchases_count existed: add it and count existing purchases
+    cursor.execute(SQL_TABLE_INFO["users"])
+    if "purchases_count" not in [col[1] for col in cursor.fetchall()]:
+        log.info("Adding missing column: purchases_count")
+        cursor.execute("ALTER TABLE users ADD COLUMN purchases_count INTEGER NOT NULL DEFAULT 0")
+        cursor.execute("UPDATE users SET purchases_count = (SELECT COUNT(*) FROM purchases WHERE user_id = users.id)")
+    
     # Verify purchases table has the correct columns
     try:
-        cursor.execute("PRAGMA table_info(purchases)")
+        cursor.execute(SQL_TABLE_INFO["purchases"])
         columns = cursor.fetchall()
         column_names = [col[1] for col in columns]
         
@@ -70,33 +188,43 @@ def verify_database_integrity():
         missing_columns = [col for col in expected_columns if col not in column_names]
         
         if missing_columns:
-            print(f"Warning: Missing columns in purchases table: {missing_columns}")
+            log.warning("Missing columns in purchases table: %s", missing_columns)
             # Add missing columns
             for column in missing_columns:
                 if column == "purchase_date":
-                    print(f"Adding missing column: {column}")
+                    log.info("Adding missing column: %s", column)
                     # SQLite has limitations on ALTER TABLE - can't add a column with DEFAULT CURRENT_TIMESTAMP
                     cursor.execute("ALTER TABLE purchases ADD COLUMN purchase_date TIMESTAMP")
                     # Update existing rows to have the current timestamp
                     cursor.execute("UPDATE purchases SET purchase_date = CURRENT_TIMESTAMP WHERE purchase_date IS NULL")
-                    conn.commit()
-            print("Database structure updated")
+            log.info("Database structure updated")
     except sqlite3.Error as e:
-        print(f"Error verifying purchases table columns: {e}")
+        log.error("Error verifying purchases table columns: %s", e)
     
-    conn.commit()
-    print("Database verification complete")
+    cursor.execute("COMMIT")  # Commit all repairs together
+    
+    # Requests assume every table exists, so refuse to start if any is still missing
+    for table in ("users", "events", "purchases"):
+        cursor.execute(SQL_TABLE_EXISTS, (table,))
+        if not cursor.fetchone():
+            raise RuntimeError(f"Database is missing the {table} table")
+    log.info("Database verification complete")
 
 # Run database verification at startup
 verify_database_integrity()
 
+# Create the tables, index and seed data in one transaction, so startup syncs to disk once
+# instead of once per statement
+cursor.execute("BEGIN")
+
 # Create tables if they don't exist
 cursor.execute("""
     CREATE TABLE IF NOT EXISTS users (
         id INTEGER PRIMARY KEY AUTOINCREMENT,  -- Unique user ID, auto-incremented
         username TEXT UNIQUE,  -- Username (must be unique)
-        password TEXT,  -- User password (stored as plain text - not secure for production)
-        points INTEGER DEFAULT 100  -- User's point balance, starts with 100 points
+        password TEXT,  -- Salted scrypt hash of the user's password ("scrypt$<salt>$<hash>")
+        points INTEGER DEFAULT 100,  -- User's point balance, starts with 100 points
+        purchases_count INTEGER NOT NULL DEFAULT 0  -- Number of tickets the user has bought (for the discount)
     )
 """)
 
@@ -123,10 +251,14 @@ cursor.execute("""
     )
 """)
 
-conn.commit()  # Commit the table creation transactions to the database
+# Index purchases by user so purchase history doesn't scan the whole table. Index entries end
+# with the rowid (purchases.id), so the history's ORDER BY p.id DESC is read straight off the
+# index without a sort.
+# (users.username is already UNIQUE, which gives it an index automatically)
+cursor.execute("CREATE INDEX IF NOT EXISTS idx_purchases_user ON purchases(user_id)")
 
 # Insert Anime Concerts (Only run this once)
-cursor.execute("SELECT COUNT(*) FROM events")  # Check if events already exist
+cursor.execute(SQL_COUNT_ROWS["events"])  # Check if events already exist
 if cursor.fetchone()[0] == 0:  # Only insert if no events exist
     cursor.executemany("""
         INSERT INTO events (name, available_tickets, vip_tickets, regular_cost, vip_cost) VALUES (?, ?, ?, ?, ?)
@@ -143,318 +275,814 @@ if cursor.fetchone()[0] == 0:  # Only insert if no events exist
         ("ReoNa SAO Alicization Tour", 65, 10, 35, 75),
         ("fripSide: Railgun Electro Night", 75, 10, 40, 85)
     ])
-    conn.commit()  # Commit the event insertions to the database
+    cursor.execute("ANALYZE")  # Give the query planner statistics for the new database
+cursor.execute("COMMIT")  # Commit the tables and event insertions together
 
 # Server setup
 HOST = "127.0.0.1"  # Localhost IP address
 PORT = 12345  # Port number for the connection
+FRAME_HEADER = struct.Struct(">I")  # Every message is prefixed with its length as a 4-byte big-endian integer
+MAX_FRAME_SIZE = 1 << 20  # Largest request body accepted (1 MB); requests are a few hundred bytes
+
+# Reusable JSON encoder with compact separators (no spaces) to keep response payloads small.
+# Responses are plain trees of dicts and lists, so the circular-reference check is skipped.
+json_encoder = json.JSONEncoder(separators=(",", ":"), check_circular=False)
+
+# Database work runs on these worker threads (each with its own connection) so the event loop
+# is never blocked by SQLite
+DB_WORKERS = 4
+db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db")
 
-server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)  # Create TCP socket object
-server.bind((HOST, PORT))  # Bind socket to the specified host and port
-server.listen(5)  # Listen for connections, queue up to 5 connection requests
-print("Server is running...")  # Display server startup message
+# In-memory copy of the events table, loaded once at startup. Only ticket counts change while
+# the server runs, and only through purchases, which write them to the database first and then
+# here, so view_events and purchase lookups never need to query SQLite.
+events = {}  # Event ID -> event dictionary
+events_cache = {"frame": None}  # Framed view_events response, rebuilt after ticket counts change
+events_lock = threading.Lock()  # Guards events and events_cache
 
-def send_response(client_socket, response_data):
+def load_events():
+    """Load every event from the database into the in-memory copy."""
+    cursor.execute(SQL_VIEW_EVENTS)
+    with events_lock:
+        events.clear()
+        events.update((row["id"], dict(row)) for row in cursor.fetchall())
+        events_cache["frame"] = None
+
+def update_event_tickets(event_id, column, remaining):
     """
-    Helper function to send JSON response to client with proper encoding and newline.
+    Record a committed ticket sale in the in-memory events.
     
     Args:
-        client_socket: Socket object for the client connection
-        response_data: Dictionary containing the response data
+        event_id: ID of the event that sold a ticket
+        column: The ticket count that changed ("available_tickets" or "vip_tickets")
+        remaining: Tickets left according to the database
+    """
+    with events_lock:
+        event = events[event_id]
+        # Counts only go down, so keep the lowest value if concurrent sales report out of order
+        event[column] = min(event[column], remaining)
+        events_cache["frame"] = None
+
+load_events()
+
+# Group commit: every write is executed by one writer thread, which collects the jobs that arrive
+# within a short window and commits them together, so a burst of purchases shares one commit.
+# Each job runs inside its own savepoint, so a rejected job is undone without affecting
+# the rest of the group.
+GROUP_COMMIT_WINDOW = 0.005  # Seconds to wait for more jobs after the first one arrives
+GROUP_COMMIT_MAX = DB_WORKERS  # Each worker waits on one job at a time, so no group can be larger
+write_queue = queue.Queue()  # (job, args, future) tuples; None stops the writer
+
+def run_write(job, *args):
+    """
+    Queue a write job for the writer thread and wait until its group has been committed.
+    
+    Args:
+        job: Function called as job(cursor, *args) that returns a response dictionary.
+            A response with "status": "error" has its changes rolled back.
+        *args: Arguments passed to the job
+        
+    Returns:
+        dict: The job's response
+    """
+    future = Future()
+    write_queue.put((job, args, future))
+    return future.result()  # Re-raises anything the job or the commit raised
+
+def writer_loop():
+    """Execute queued write jobs in groups, committing each group once. Runs on the writer thread."""
+    writer_conn = open_db()  # The writer's own connection
+    writer_cursor = writer_conn.cursor()
+    stopping = False
+    while not stopping:
+        first = write_queue.get()  # Block until there is work
+        if first is None:
+            break
+        jobs = [first]
+        deadline = time.monotonic() + GROUP_COMMIT_WINDOW
+        while len(jobs) < GROUP_COMMIT_MAX:  # Collect whatever else arrives within the window
+            try:
+                item = write_queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if item is None:  # Finish this group, then stop
+                stopping = True
+                break
+            jobs.append(item)
+
+        done = []  # (future, response) for jobs that ran, resolved once the group is committed
+        try:
+            writer_cursor.execute("BEGIN IMMEDIATE")  # Take the write lock for the whole group
+            for job, args, future in jobs:
+                writer_cursor.execute("SAVEPOINT job")
+                try:
+                    response = job(writer_cursor, *args)
+                except Exception as e:
+                    writer_cursor.execute("ROLLBACK TO job")
+                    writer_cursor.execute("RELEASE job")
+                    future.set_exception(e)
+                    continue
+                if response.get("status") == "error":  # Rejected: undo just this job's changes
+                    writer_cursor.execute("ROLLBACK TO job")
+                writer_cursor.execute("RELEASE job")
+                done.append((future, response))
+            writer_cursor.execute("COMMIT")  # One commit for the whole group
+        except Exception as e:
+            writer_conn.rollback()  # No-op if BEGIN itself failed
+            for future, _ in done:
+                future.set_exception(e)
+            for _, _, future in jobs:  # Jobs that never ran
+                if not future.done():
+                    future.set_exception(e)
+            continue
+        for future, response in done:
+            future.set_result(response)
+    writer_conn.close()
+
+writer_thread = threading.Thread(target=writer_loop, name="db-writer", daemon=True)
+writer_thread.start()
+
+# scrypt cost parameters for password hashes (~16 MB of memory per hash)
+SCRYPT_PARAMS = {"n": 16384, "r": 8, "p": 1, "dklen": 32}
+
+# Password hashing and verification (tens of ms of CPU each) run on their own threads, so a burst
+# of logins or registrations can't tie up the database workers and stall every other request
+HASH_WORKERS = 2
+hash_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="hash")
+
+def hash_password(password):
+    """
+    Hash a password with a fresh random salt for storage.
+    
+    Args:
+        password: The plain-text password
+        
+    Returns:
+        str: "scrypt$<salt hex>$<hash hex>"
+    """
+    salt = os.urandom(16)
+    digest = hashlib.scrypt(password.encode(), salt=salt, **SCRYPT_PARAMS)
+    return f"scrypt${salt.hex()}${digest.hex()}"
+
+def is_password_hash(stored):
+    """
+    Tell a stored scrypt hash apart from a legacy plain-text password, which could itself start
+    with "scrypt$".
+    
+    Args:
+        stored: The value from the users.password column
+        
+    Returns:
+        bool: True if stored has the exact shape hash_password produces
+    """
+    parts = stored.split("$")
+    if len(parts) != 3 or parts[0] != "scrypt":
+        return False
+    try:
+        salt, digest = bytes.fromhex(parts[1]), bytes.fromhex(parts[2])
+    except ValueError:  # Not hex, so not one of our hashes
+        return False
+    return len(salt) == 16 and len(digest) == SCRYPT_PARAMS["dklen"]
+
+def verify_password(password, stored):
+    """
+    Check a password against its stored value in constant time.
+    Accounts created before hashing was introduced still hold plain text, which is compared directly.
+    
+    Args:
+        password: The plain-text password supplied by the client
+        stored: The value from the users.password column
+        
+    Returns:
+        bool: True if the password matches
+    """
+    if not is_password_hash(stored):  # Legacy plain-text password
+        return hmac.compare_digest(password.encode(), stored.encode())
+    _, salt_hex, digest_hex = stored.split("$")
+    digest = hashlib.scrypt(password.encode(), salt=bytes.fromhex(salt_hex), **SCRYPT_PARAMS)
+    return hmac.compare_digest(digest, bytes.fromhex(digest_hex))
+
+# Recently verified logins, so a user logging in again (e.g. after a reconnect) skips the scrypt
+# work. Only scrypt hashes are cached: legacy plain-text values are cheap to compare and must not
+# end up in the cache. Entries are keyed by the stored hash, so changing a password invalidates
+# them, and by a BLAKE2b digest of the password keyed with a per-process secret, so the cache
+# never holds anything that could be used to recover a password.
+LOGIN_CACHE_TTL = 300.0  # Seconds a successful verification is remembered
+LOGIN_CACHE_SIZE = 4096  # Most entries kept; the cache is emptied when it fills up
+LOGIN_CACHE_KEY = os.urandom(32)
+login_cache = {}  # (stored hash, password digest) -> expiry time
+login_cache_lock = threading.Lock()
+
+def verify_password_cached(password, stored):
+    """
+    verify_password, reusing a recent successful verification of the same password.
+    Legacy plain-text passwords are checked directly and never cached.
+    
+    Args:
+        password: The plain-text password supplied by the client
+        stored: The value from the users.password column
+        
+    Returns:
+        bool: True if the password matches
+    """
+    if not is_password_hash(stored):  # Legacy plain text: nothing to save, and it must not be kept
+        return verify_password(password, stored)
+    key = (stored, hashlib.blake2b(password.encode(), key=LOGIN_CACHE_KEY, digest_size=16).digest())
+    now = time.monotonic()
+    with login_cache_lock:
+        expires = login_cache.get(key)
+    if expires is not None and now < expires:
+        return True
+    if not verify_password(password, stored):  # Only successes are cached
+        return False
+    with login_cache_lock:
+        if len(login_cache) >= LOGIN_CACHE_SIZE:
+            login_cache.clear()
+        login_cache[key] = now + LOGIN_CACHE_TTL
+    return True
+
+def frame_message(payload):
+    """
+    Prefix an encoded message with its length, producing the exact bytes sent on the wire.
+    
+    Args:
+        payload: The encoded JSON message
+        
+    Returns:
+        bytes: The length-prefixed message
+    """
+    return FRAME_HEADER.pack(len(payload)) + payload  # Length prefix marks the message boundary
+
+async def send_response(writer, response_data):
+    """
+    Helper function to send JSON response to client with proper encoding and length prefix.
+    
+    Args:
+        writer: StreamWriter for the client connection
+        response_data: Dictionary containing the response data, or an already-framed message (bytes or bytearray)
     """
     try:
-        json_response = json.dumps(response_data) + '\n'  # Add newline to mark end of message
-        client_socket.send(json_response.encode())
+        if isinstance(response_data, (bytes, bytearray)):  # Cached or streamed responses arrive already framed
+            writer.write(response_data)
+        else:
+            payload = json_encoder.encode(response_data).encode()
+            # Hand over the length prefix and body as separate buffers instead of concatenating
+            # them; asyncio sends them together (with a single scatter-gather sendmsg on 3.12+)
+            writer.writelines((FRAME_HEADER.pack(len(payload)), payload))
+        await writer.drain()  # Wait until the transport has accepted the whole message
     except Exception as e:
-        print(f"Error sending response: {e}")
+        log.error("Error sending response: %s", e)
         raise
 
-def handle_client(client_socket):
+def _do_batch(request, cursor):
     """
-    Handle communication with a connected client.
+    Run several requests from one message and answer with one JSON array.
+    
+    Args:
+        request: Dictionary parsed from the client's JSON request
+        cursor: The worker thread's database cursor
+        
+    Returns:
+        dict or bytes: The framed array of responses, or an error response
+    """
+    return process_batch(request.get("items"))
+
+async def _do_register(request):
+    """
+    Register a new user with a hashed password.
+    Runs on the event loop: the hash is computed on hash_executor, the insert on db_executor.
+    
+    Args:
+        request: Dictionary parsed from the client's JSON request
+        
+    Returns:
+        dict: The response to send back
+    """
+    username = request.get("username")  # Get username from request
+    password = request.get("password")  # Get password from request
+    if not isinstance(username, str) or not isinstance(password, str) or not username or not password:
+        return {"status": "error", "message": "Username and password are required"}
+    loop = asyncio.get_running_loop()
+    password_hash = await loop.run_in_executor(hash_executor, hash_password, password)
+    try:
+        # Insert new user into database, storing only a salted hash of the password
+        await loop.run_in_executor(db_executor, run_write, register_job, username, password_hash)
+        # Send success response to client
+        return {"status": "success", "message": "User registered successfully"}
+    except sqlite3.IntegrityError:  # Handle case where username already exists
+        # Send error response to client
+        return {"status": "error", "message": "Username already exists"}
+
+def register_job(cursor, username, password_hash):
+    """
+    Write job that inserts a new user.
+    
+    Args:
+        cursor: The writer thread's cursor
+        username: The new username (raises sqlite3.IntegrityError if taken)
+        password_hash: The hashed password
+        
+    Returns:
+        dict: Success response
+    """
+    cursor.execute(SQL_REGISTER, (username, password_hash))
+    return {"status": "success"}
+
+def find_user(username):
+    """
+    Look a user up by username on the calling database worker's connection.
+    
+    Args:
+        username: The username to look up
+        
+    Returns:
+        sqlite3.Row or None: (id, points, password) of the user, or None if there is no such user
+    """
+    cursor = get_cursor()
+    cursor.execute(SQL_LOGIN, (username,))  # By username only (uses its unique index)
+    return cursor.fetchone()
+
+async def _do_login(request):
+    """
+    Check a user's credentials and return their ID and points.
+    Runs on the event loop: the lookup runs on db_executor, the password check on hash_executor.
+    
+    Args:
+        request: Dictionary parsed from the client's JSON request
+        
+    Returns:
+        dict: The response to send back
+    """
+    username = request.get("username")  # Get username from request
+    password = request.get("password")  # Get password from request
+    loop = asyncio.get_running_loop()
+    
+    # Look the user up by username, then check the password off the database workers
+    user = await loop.run_in_executor(db_executor, find_user, username)
+    if (user and isinstance(password, str) and user[2] is not None
+            and await loop.run_in_executor(hash_executor, verify_password_cached, password, user[2])):
+        if not is_password_hash(user[2]):  # Upgrade a legacy plain-text password to a hash
+            password_hash = await loop.run_in_executor(hash_executor, hash_password, password)
+            await loop.run_in_executor(db_executor, run_write, set_password_job, password_hash, user[0])
+        # Send success response with user ID and points
+        return {"status": "success", "user_id": user[0], "points": user[1]}
+    else:
+        # Send error response if credentials are invalid
+        return {"status": "error", "message": "Invalid credentials"}
+
+def set_password_job(cursor, password_hash, user_id):
+    """
+    Write job that replaces a user's stored password.
+    
+    Args:
+        cursor: The writer thread's cursor
+        password_hash: The hashed password
+        user_id: ID of the user
+        
+    Returns:
+        dict: Success response
+    """
+    cursor.execute(SQL_SET_PASSWORD, (password_hash, user_id))
+    return {"status": "success"}
+
+def _do_view_events(request, cursor):
+    """
+    Return all events, encoded once per change to the ticket counts.
+    
+    Args:
+        request: Dictionary parsed from the client's JSON request
+        cursor: The worker thread's database cursor
+        
+    Returns:
+        bytes: The framed response, ready to send as is
+    """
+    with events_lock:
+        if events_cache["frame"] is None:  # Encode and frame once after each change, then reuse the bytes
+            events_cache["frame"] = frame_message(json_encoder.encode({"status": "success", "events": list(events.values())}).encode())
+        # Send success response with the events data
+        return events_cache["frame"]
+
+def _do_purchase_ticket(request, cursor):
+    """
+    Buy one ticket for an event, charging the user's points.
+    
+    Args:
+        request: Dictionary parsed from the client's JSON request
+        cursor: The worker thread's database cursor
+        
+    Returns:
+        dict: The response to send back
+    """
+    user_id = request.get("user_id")  # Get user ID from request
+    event_id = request.get("event_id")  # Get event ID from request
+    ticket_type = request.get("ticket_type")  # Get ticket type from request
+
+    is_vip = ticket_type == "VIP"  # Anything other than VIP is treated as a regular ticket
+
+    try:
+        event_id = int(event_id)  # The client sends the ID as typed
+    except (TypeError, ValueError):
+        return {"status": "error", "message": "Event not found"}
+    if event_id not in events:  # Check the in-memory events instead of querying
+        return {"status": "error", "message": "Event not found"}
+
+    # The writer thread runs the purchase and commits it (possibly together with other purchases)
+    response = run_write(purchase_job, user_id, event_id, ticket_type, is_vip)
+    if response["status"] == "success":
+        # The sale is committed; mirror the new ticket count in memory
+        update_event_tickets(event_id, "vip_tickets" if is_vip else "available_tickets", response["tickets_left"])
+    return response
+
+def purchase_job(cursor, user_id, event_id, ticket_type, is_vip):
+    """
+    Write job that buys one ticket. Runs on the writer thread inside the group's transaction;
+    the guarded UPDATEs check and change stock/points in a single statement each, so concurrent
+    buyers can't oversell or overspend.
+    
+    Args:
+        cursor: The writer thread's cursor
+        user_id: ID of the buying user
+        event_id: ID of an existing event
+        ticket_type: "VIP" or "Regular"
+        is_vip: Whether a VIP ticket is being bought
+        
+    Returns:
+        dict: The response to send back; an error response makes the writer undo the job's changes
+    """
+    # Take one ticket if any are left, getting its cost back from the same statement
+    cursor.execute(SQL_TAKE_VIP_TICKET if is_vip else SQL_TAKE_REGULAR_TICKET, (event_id,))
+    event = cursor.fetchone()
+    if event is None:  # Nothing updated: tickets of this type are sold out
+        # Send error if tickets of this type are sold out
+        return {"status": "error", "message": "VIP tickets sold out" if is_vip else "Regular tickets sold out"}
+
+    # Deduct the (possibly discounted) price only if the user can afford it, getting the new
+    # balance and the price charged back
+    cursor.execute(SQL_CHARGE_USER, {"user_id": user_id, "base_cost": event[0]})
+    user = cursor.fetchone()
+    if user is None:  # Nothing updated: the user doesn't exist or can't afford it
+        cursor.execute(SQL_USER_POINTS, (user_id,))
+        if cursor.fetchone() is None:
+            return {"status": "error", "message": "User not found"}
+        # Send error if not enough points
+        return {"status": "error", "message": "Not enough points"}
+
+    ticket_cost = user[1]  # Price actually charged
+
+    # Record the purchase
+    cursor.execute(SQL_RECORD_PURCHASE, (user_id, event_id, ticket_type))
+    # Send success response with purchase details, the new balance and the tickets left
+    return {"status": "success", "message": f"{ticket_type} Ticket purchased for {ticket_cost} points", "points": user[0], "tickets_left": event[1]}
+
+def _do_check_points(request, cursor):
+    """
+    Return the user's points balance.
+    
+    Args:
+        request: Dictionary parsed from the client's JSON request
+        cursor: The worker thread's database cursor
+        
+    Returns:
+        dict: The response to send back
+    """
+    user_id = request.get("user_id")  # Get user ID from request
+    # Query user points
+    cursor.execute(SQL_USER_POINTS, (user_id,))
+    user = cursor.fetchone()  # Get user data
+    if user is None:  # Check if user exists
+        return {"status": "error", "message": "User not found"}
+    # Send success response with points balance
+    return {"status": "success", "points": user[0]}
+
+def _do_add_funds(request, cursor):
+    """
+    Add points to a user's balance.
+    
+    Args:
+        request: Dictionary parsed from the client's JSON request
+        cursor: The worker thread's database cursor
+        
+    Returns:
+        dict: The response to send back
+    """
+    userid = request.get("userid")
+    amount = request.get("amount")
+    if not isinstance(amount, int) or isinstance(amount, bool) or amount <= 0:
+        return {"status": "error", "message": "Invalid amount"}
+    return run_write(add_funds_job, userid, amount)
+
+def add_funds_job(cursor, userid, amount):
+    """
+    Write job that adds points to a user's balance.
+    
+    Args:
+        cursor: The writer thread's cursor
+        userid: ID of the user
+        amount: Positive number of points to add
+        
+    Returns:
+        dict: The response to send back, including the new balance
+    """
+    # Add the points and get the new balance back from the same statement, so the
+    # client doesn't need a separate check_points request
+    cursor.execute(SQL_ADD_POINTS, (amount, userid))
+    user = cursor.fetchone()
+    if user is None:  # Nothing updated: no such user
+        return {"status": "error", "message": "User not found"}
+    return {"status": "success", "message": f"Added {amount} points to user {userid}", "points": user[0]}
+
+def _do_view_purchases(request, cursor):
+    """
+    Return the user's purchase history, newest first.
+    
+    Args:
+        request: Dictionary parsed from the client's JSON request
+        cursor: The worker thread's database cursor
+        
+    Returns:
+        dict or bytearray: The response to send back; a purchase history comes back already framed
+    """
+    try:
+        user_id = request.get("user_id")
+        log.debug("Processing view_purchases for user_id: %s", user_id)
+        
+        if not user_id:
+            log.debug("Missing user_id in view_purchases request")
+            return {"status": "error", "message": "User ID is required"}
+            
+        # First verify the user exists
+        cursor.execute(SQL_USER_EXISTS, (user_id,))
+        user_result = cursor.fetchone()
+        if not user_result:
+            log.debug("User %s not found in database", user_id)
+            return {"status": "error", "message": "User not found"}
+
+        # Use LEFT JOIN to handle cases where event might have been deleted
+        try:
+            # Stream the rows straight from the cursor into the framed response, one encoded
+            # purchase object at a time, instead of building a list of every purchase first
+            frame = bytearray(FRAME_HEADER.size)  # Length prefix, filled in once the body is complete
+            frame += b'{"status":"success","purchases":['
+            encode = json_encoder.encode
+            count = 0
+            for row in cursor.execute(SQL_USER_PURCHASES, (user_id,)):
+                if count:
+                    frame += b","
+                frame += encode(dict(row)).encode()
+                count += 1
+            log.debug("Found %d purchases", count)
+            
+            if not count:
+                return {"status": "success", "purchases": [], "message": "No purchases found"}
+            frame += b"]}"
+            FRAME_HEADER.pack_into(frame, 0, len(frame) - FRAME_HEADER.size)
+            return frame
+        except sqlite3.Error as e:
+            error_msg = f"Database error in purchases query: {str(e)}"
+            log.error(error_msg)
+            return {"status": "error", "message": error_msg}
+            
+    except sqlite3.Error as e:
+        error_msg = f"Database error in view_purchases: {str(e)}"
+        log.error(error_msg)
+        return {"status": "error", "message": error_msg}
+    except Exception as e:
+        error_msg = f"Error in view_purchases: {str(e)}"
+        log.error(error_msg)
+        return {"status": "error", "message": error_msg}
+
+def _do_diagnose_db(request, cursor):
+    """
+    Report table sizes, columns and a sample purchases query for troubleshooting.
+    
+    Args:
+        request: Dictionary parsed from the client's JSON request
+        cursor: The worker thread's database cursor
+        
+    Returns:
+        dict: The response to send back
+    """
+    try:
+        # Check all tables
+        tables_result = {}
+        for table in DIAGNOSE_TABLES:
+            cursor.execute(SQL_COUNT_ROWS[table])
+            count = cursor.fetchone()[0]
+            cursor.execute(SQL_TABLE_INFO[table])
+            columns = [col[1] for col in cursor.fetchall()]
+            tables_result[table] = {
+                "count": count,
+                "columns": columns
+            }
+        
+        # Test a sample query
+        test_query_result = {}
+        if tables_result["users"]["count"] > 0:
+            # Get a sample user
+            cursor.execute(SQL_SAMPLE_USER)
+            test_user_id = cursor.fetchone()[0]
+            test_query_result["sample_user_id"] = test_user_id
+            
+            # Try the purchases query
+            try:
+                sample_purchases = [dict(row) for row in cursor.execute(SQL_USER_PURCHASES, (test_user_id,))]
+                test_query_result["sample_purchases_count"] = len(sample_purchases)
+                test_query_result["sample_purchase_data"] = sample_purchases[:1] if sample_purchases else []
+            except sqlite3.Error as e:
+                test_query_result["error"] = str(e)
+        
+        # Check foreign keys status
+        cursor.execute(SQL_FOREIGN_KEYS)
+        foreign_keys_enabled = cursor.fetchone()[0]
+        
+        diagnosis = {
+            "tables": tables_result,
+            "test_query": test_query_result,
+            "foreign_keys_enabled": foreign_keys_enabled
+        }
+        
+        return {
+            "status": "success", 
+            "message": "Database diagnosis complete", 
+            "diagnosis": diagnosis
+        }
+    except Exception as e:
+        return {
+            "status": "error", 
+            "message": f"Diagnosis error: {str(e)}"
+        }
+
+def _do_unknown(request, cursor):
+    """
+    Answer a request whose action has no handler, so the client isn't left waiting for a reply.
+    
+    Args:
+        request: Dictionary parsed from the client's JSON request
+        cursor: The worker thread's database cursor
+        
+    Returns:
+        dict: The error response
+    """
+    return {"status": "error", "message": f"Unknown action: {request['action']}"}
+
+# Request handlers by action name; each takes (request, cursor) and returns the response
+HANDLERS = {
+    "batch": _do_batch,
+    "view_events": _do_view_events,
+    "purchase_ticket": _do_purchase_ticket,
+    "check_points": _do_check_points,
+    "add_funds": _do_add_funds,
+    "view_purchases": _do_view_purchases,
+    "diagnose_db": _do_diagnose_db,
+}
+
+# Handlers that hash passwords; they are coroutines taking (request) and run on the event loop,
+# handing the scrypt work to hash_executor and only the SQL to db_executor
+ASYNC_HANDLERS = {
+    "register": _do_register,
+    "login": _do_login,
+}
+
+def process_request(request):
+    """
+    Execute a single client request against the database.
+    Runs on a database worker thread, never on the event loop.
+    
+    Args:
+        request: Value parsed from the client's JSON request (a dictionary, if well formed)
+        
+    Returns:
+        dict or bytes: The response (or its framed JSON) to send back
+    """
+    # Every request must be a JSON object with a string action
+    action = request.get("action") if isinstance(request, dict) else None
+    if not isinstance(action, str):
+        return {"status": "error", "message": "Invalid request"}
+    handler = HANDLERS.get(action, _do_unknown)  # Look up the handler for the requested action
+    return handler(request, get_cursor())  # Run it on this worker thread's own cursor
+
+# A batch may only bundle these cheap read-only actions, and only a few of them, so one message
+# can't hold a database worker for long (writes and password checks must be sent on their own)
+BATCH_ACTIONS = frozenset({"check_points", "view_events", "view_purchases"})
+BATCH_MAX_ITEMS = 8
+
+def process_batch(items):
+    """
+    Execute a list of requests in order and combine their responses into one JSON array,
+    so a client can make several related calls in a single round-trip.
+    
+    Args:
+        items: List of request dictionaries, each with an action from BATCH_ACTIONS
+        
+    Returns:
+        dict or bytes: The framed array of responses, or an error if items is not a list of requests
+    """
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        return {"status": "error", "message": "Batch items must be a list of requests"}
+    if len(items) > BATCH_MAX_ITEMS:
+        return {"status": "error", "message": f"Batches are limited to {BATCH_MAX_ITEMS} requests"}
+    parts = []
+    for item in items:
+        action = item.get("action")
+        if not isinstance(action, str) or action not in BATCH_ACTIONS:  # Also rules out nested batches
+            result = {"status": "error", "message": f"Action not allowed in a batch: {action}"}
+        else:
+            result = process_request(item)
+        if isinstance(result, (bytes, bytearray)):  # Already-framed responses; embed just the JSON
+            parts.append(memoryview(result)[FRAME_HEADER.size:])
+        else:
+            parts.append(json_encoder.encode(result).encode())
+    return frame_message(b"[" + b",".join(parts) + b"]")
+
+def tune_client_socket(client_socket):
+    """
+    Apply TCP options suited to small request/response messages to an accepted connection.
     
     Args:
         client_socket: Socket object for the client connection
     """
+    client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # Send small responses immediately (no Nagle delay)
+    client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)  # Detect clients that vanished while idle
+    # Linux only: a one-shot hint to leave quick-ack mode on for now. The kernel can fall back to
+    # delayed ACKs later, so this only helps the first exchanges, not the whole connection.
+    # (The send buffer is left to the kernel's autotuning; responses are a few KB.)
+    if hasattr(socket, "TCP_QUICKACK"):
+        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+
+async def handle_client(reader, writer):
+    """
+    Handle communication with a connected client.
+    
+    Args:
+        reader: StreamReader for the client connection
+        writer: StreamWriter for the client connection
+    """
+    peer = writer.get_extra_info("peername")
+    log.debug("Connected to %s", peer)  # Log the connection
+    tune_client_socket(writer.get_extra_info("socket"))
+    loop = asyncio.get_running_loop()
+    # Bind everything the request loop calls to locals, which are cheaper to look up than
+    # module globals and attributes on every request
+    read = reader.readexactly
+    header_size, unpack = FRAME_HEADER.size, FRAME_HEADER.unpack
+    loads = json.loads
+    run = loop.run_in_executor
+    send = send_response
+    async_handlers = ASYNC_HANDLERS
     while True:  # Continuous loop to handle client requests
         try:
-            data = client_socket.recv(1024).decode()  # Receive data from client (1024 bytes buffer), decode from bytes
-            if not data:  # Check if client disconnected
-                break  # Exit the loop if no data received
-            
-            request = json.loads(data)  # Parse JSON data into Python dictionary
-            action = request.get("action")  # Extract the requested action from the data
+            try:
+                header = await read(header_size)  # Length prefix of the next request
+            except asyncio.IncompleteReadError:  # Check if client disconnected
+                break  # Exit the loop if the connection closed
+            (length,) = unpack(header)
+            if length > MAX_FRAME_SIZE:  # Refuse before buffering it; the stream can't be resynced
+                await send(writer, {"status": "error", "message": "Request too large"})
+                break
+            data = await read(length)  # Receive exactly one request body as raw bytes
 
-            if action == "register":  # Handle user registration
-                username = request.get("username")  # Get username from request
-                password = request.get("password")  # Get password from request
-                try:
-                    # Insert new user into database
-                    cursor.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, password))
-                    conn.commit()  # Commit the transaction
-                    # Send success response to client
-                    send_response(client_socket, {"status": "success", "message": "User registered successfully"})
-                except sqlite3.IntegrityError:  # Handle case where username already exists
-                    # Send error response to client
-                    send_response(client_socket, {"status": "error", "message": "Username already exists"})
-
-            elif action == "login":  # Handle user login
-                username = request.get("username")  # Get username from request
-                password = request.get("password")  # Get password from request
-                
-                # VULNERABILITY: SQL INJECTION - Direct string concatenation in SQL query
-                # This allows attackers to inject malicious SQL code through the username or password fields
-                # Example attack: username = "admin' --" would bypass password check
-                cursor.execute(f"SELECT id, points FROM users WHERE username = '{username}' AND password = '{password}'")
-                user = cursor.fetchone()  # Get first matching row
-                if user:  # Check if user was found
-                    # Send success response with user ID and points
-                    send_response(client_socket, {"status": "success", "user_id": user[0], "points": user[1]})
-                else:
-                    # Send error response if credentials are invalid
-                    send_response(client_socket, {"status": "error", "message": "Invalid credentials"})
-
-            elif action == "view_events":  # Handle request to view all events
-                cursor.execute("SELECT * FROM events")  # Query all events from database
-                events = cursor.fetchall()  # Get all rows from the query
-                # Format events data for JSON serialization
-                formatted_events = []
-                for event in events:
-                    formatted_events.append({
-                        "id": event[0],
-                        "name": event[1],
-                        "available_tickets": event[2],
-                        "vip_tickets": event[3],
-                        "regular_cost": event[4],
-                        "vip_cost": event[5]
-                    })
-                # Send success response with formatted events data
-                send_response(client_socket, {"status": "success", "events": formatted_events})
-
-            elif action == "purchase_ticket":  # Handle ticket purchase request
-                user_id = request.get("user_id")  # Get user ID from request
-                event_id = request.get("event_id")  # Get event ID from request
-                ticket_type = request.get("ticket_type")  # Get ticket type from request
-
-                # Query user points
-                cursor.execute("SELECT points FROM users WHERE id = ?", (user_id,))
-                user = cursor.fetchone()  # Get user data
-
-                # Query event details
-                cursor.execute("SELECT available_tickets, vip_tickets, regular_cost, vip_cost FROM events WHERE id = ?", (event_id,))
-                event = cursor.fetchone()  # Get event data
-
-                # Count how many tickets the user has already purchased (for discount calculation)
-                cursor.execute("SELECT COUNT(*) FROM purchases WHERE user_id = ?", (user_id,))
-                purchase_count = cursor.fetchone()[0]  # Get count of previous purchases
-
-                if user and event:  # Check if both user and event exist
-                    user_points = user[0]  # Extract user points
-                    available_tickets, vip_tickets, regular_cost, vip_cost = event  # Extract event data
-                    ticket_cost = vip_cost if ticket_type == "VIP" else regular_cost  # Determine ticket cost based on type
-
-                    if purchase_count >= 3:  # Apply 10% discount if user has purchased 3 or more tickets
-                        ticket_cost = int(ticket_cost * 0.9)  # Calculate discounted price
-
-                    if ticket_cost > user_points:  # Check if user has enough points
-                        # Send error if not enough points
-                        send_response(client_socket, {"status": "error", "message": "Not enough points"})
-                    elif ticket_type == "VIP" and vip_tickets <= 0:  # Check if VIP tickets are available
-                        # Send error if VIP tickets sold out
-                        send_response(client_socket, {"status": "error", "message": "VIP tickets sold out"})
-                    elif ticket_type == "Regular" and available_tickets <= 0:  # Check if regular tickets are available
-                        # Send error if regular tickets sold out
-                        send_response(client_socket, {"status": "error", "message": "Regular tickets sold out"})
-                    else:
-                        # Deduct points from user
-                        cursor.execute("UPDATE users SET points = points - ? WHERE id = ?", (ticket_cost, user_id))
-                        if ticket_type == "VIP":  # If VIP ticket
-                            # Decrease VIP ticket count
-                            cursor.execute("UPDATE events SET vip_tickets = vip_tickets - 1 WHERE id = ?", (event_id,))
-                        else:  # If regular ticket
-                            # Decrease regular ticket count
-                            cursor.execute("UPDATE events SET available_tickets = available_tickets - 1 WHERE id = ?", (event_id,))
-                        # Record the purchase
-                        cursor.execute("INSERT INTO purchases (user_id, event_id, ticket_type) VALUES (?, ?, ?)", (user_id, event_id, ticket_type))
-                        conn.commit()  # Commit all transaction changes
-                        # Send success response with purchase details
-                        send_response(client_socket, {"status": "success", "message": f"{ticket_type} Ticket purchased for {ticket_cost} points"})
-            elif action == "check_points":  # Handle request to check points balance
-                user_id = request.get("user_id")  # Get user ID from request
-                # Query user points
-                cursor.execute("SELECT points FROM users WHERE id = ?", (user_id,))
-                user = cursor.fetchone()  # Get user data
-                if user:  # Check if user exists
-                    # Send success response with points balance
-                    send_response(client_socket, {"status": "success", "points": user[0]})
-            elif action == "add_funds":
-                userid = request.get("userid")
-                amount = request.get("amount")
-                if amount <= 0:
-                    send_response(client_socket, {"status": "error", "message": "Invalid amount"})
-                else:
-                    cursor.execute("UPDATE users SET points = points + ? WHERE id = ?", (amount, userid))
-                    conn.commit()
-                    send_response(client_socket, {"status": "success", "message": f"Added {amount} points to user {userid}"})
-            elif action == "view_purchases":
-                try:
-                    user_id = request.get("user_id")
-                    print(f"Processing view_purchases for user_id: {user_id}")  # Debug output
-                    
-                    if not user_id:
-                        print("Error: Missing user_id in request")  # Debug output
-                        send_response(client_socket, {"status": "error", "message": "User ID is required"})
-                        return
-                        
-                    # First verify the user exists
-                    cursor.execute("SELECT id FROM users WHERE id = ?", (user_id,))
-                    user_result = cursor.fetchone()
-                    if not user_result:
-                        print(f"Error: User {user_id} not found in database")  # Debug output
-                        send_response(client_socket, {"status": "error", "message": "User not found"})
-                        return
-
-                    try:
-                        # Check if purchases table exists
-                        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='purchases'")
-                        if not cursor.fetchone():
-                            print("Error: Purchases table does not exist")  # Debug output
-                            send_response(client_socket, {"status": "error", "message": "Purchases table does not exist"})
-                            return
-                            
-                        # Check if events table exists
-                        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='events'")
-                        if not cursor.fetchone():
-                            print("Error: Events table does not exist")  # Debug output
-                            send_response(client_socket, {"status": "error", "message": "Events table does not exist"})
-                            return
-                    except sqlite3.Error as e:
-                        print(f"Database error checking tables: {e}")  # Debug output
-                        send_response(client_socket, {"status": "error", "message": f"Database error checking tables: {str(e)}"})
-                        return
-
-                    # Use LEFT JOIN to handle cases where event might have been deleted
-                    try:
-                        print("Executing purchases query...")  # Debug output
-                        query = """
-                            SELECT p.id, p.event_id, p.ticket_type, p.purchase_date, 
-                                   COALESCE(e.name, 'Unknown Event') as event_name
-                            FROM purchases p
-                            LEFT JOIN events e ON p.event_id = e.id
-                            WHERE p.user_id = ? 
-                            ORDER BY p.id DESC
-                        """
-                        print(f"Query: {query}")  # Debug output
-                        cursor.execute(query, (user_id,))
-                        purchases = cursor.fetchall()
-                        print(f"Found {len(purchases)} purchases")  # Debug output
-                        
-                        if not purchases:
-                            send_response(client_socket, {"status": "success", "purchases": [], "message": "No purchases found"})
-                        else:
-                            send_response(client_socket, {"status": "success", "purchases": purchases})
-                    except sqlite3.Error as e:
-                        error_msg = f"Database error in purchases query: {str(e)}"
-                        print(error_msg)  # Debug output
-                        send_response(client_socket, {"status": "error", "message": error_msg})
-                        return
-                        
-                except sqlite3.Error as e:
-                    error_msg = f"Database error in view_purchases: {str(e)}"
-                    print(error_msg)  # Debug output
-                    send_response(client_socket, {"status": "error", "message": error_msg})
-                except Exception as e:
-                    error_msg = f"Error in view_purchases: {str(e)}"
-                    print(error_msg)  # Debug output
-                    send_response(client_socket, {"status": "error", "message": error_msg})
-                
-            # Add a diagnostic action
-            elif action == "diagnose_db":
-                try:
-                    # Check all tables
-                    tables_result = {}
-                    for table in ["users", "events", "purchases"]:
-                        cursor.execute(f"SELECT COUNT(*) FROM {table}")
-                        count = cursor.fetchone()[0]
-                        cursor.execute(f"PRAGMA table_info({table})")
-                        columns = [col[1] for col in cursor.fetchall()]
-                        tables_result[table] = {
-                            "count": count,
-                            "columns": columns
-                        }
-                    
-                    # Test a sample query
-                    test_query_result = {}
-                    if tables_result["users"]["count"] > 0:
-                        # Get a sample user
-                        cursor.execute("SELECT id FROM users LIMIT 1")
-                        test_user_id = cursor.fetchone()[0]
-                        test_query_result["sample_user_id"] = test_user_id
-                        
-                        # Try the purchases query
-                        try:
-                            cursor.execute("""
-                                SELECT p.id, p.event_id, p.ticket_type, p.purchase_date, 
-                                       COALESCE(e.name, 'Unknown Event') as event_name
-                                FROM purchases p
-                                LEFT JOIN events e ON p.event_id = e.id
-                                WHERE p.user_id = ? 
-                                ORDER BY p.id DESC
-                            """, (test_user_id,))
-                            sample_purchases = cursor.fetchall()
-                            test_query_result["sample_purchases_count"] = len(sample_purchases)
-                            test_query_result["sample_purchase_data"] = sample_purchases[:1] if sample_purchases else []
-                        except sqlite3.Error as e:
-                            test_query_result["error"] = str(e)
-                    
-                    # Check foreign keys status
-                    cursor.execute("PRAGMA foreign_keys")
-                    foreign_keys_enabled = cursor.fetchone()[0]
-                    
-                    diagnosis = {
-                        "tables": tables_result,
-                        "test_query": test_query_result,
-                        "foreign_keys_enabled": foreign_keys_enabled
-                    }
-                    
-                    send_response(client_socket, {
-                        "status": "success", 
-                        "message": "Database diagnosis complete", 
-                        "diagnosis": diagnosis
-                    })
-                except Exception as e:
-                    send_response(client_socket, {
-                        "status": "error", 
-                        "message": f"Diagnosis error: {str(e)}"
-                    })
-                
+            request = loads(data)  # Parse JSON data (decoded from UTF-8 in one pass) into Python dictionary
+            action = request.get("action") if isinstance(request, dict) else None
+            if isinstance(action, str) and action in async_handlers:
+                response = await async_handlers[action](request)  # Login/register: hashing off the DB workers
+            else:
+                # Run the database work on the worker thread and wait for its response
+                response = await run(db_executor, process_request, request)
+            await send(writer, response)
+            
         except Exception as e:  # Handle any exceptions that occur
-            print("Error:", e)  # Print error to server console
+            log.error("Error handling request from %s: %s", peer, e)  # Log the error on the server
             try:
                 # Try to send error response to client
-                send_response(client_socket, {"status": "error", "message": "An error occurred"})
+                await send_response(writer, {"status": "error", "message": "An error occurred"})
             except:
                 pass  # Ignore if sending fails (connection may be closed)
             break  # Exit the loop on error
-    
-    print(f"Client disconnected")  # Log client disconnection
-    client_socket.close()  # Close the client socket
+
+    log.debug("Client %s disconnected", peer)  # Log client disconnection
+    writer.close()  # Close the client connection
+
+async def main():
+    """
+    Start the server and serve client connections until cancelled.
+    """
+    # Listen for connections on the event loop; reuse_address lets a restarted server bind immediately
+    server = await asyncio.start_server(handle_client, HOST, PORT, reuse_address=True)
+    log.info("Server is running on %s:%d", HOST, PORT)  # Log server startup
+    async with server:
+        await server.serve_forever()  # Accept connections until interrupted
 
 # Main server loop
-while True:  # Infinite loop to accept new connections
-    try:
-        client_socket, addr = server.accept()  # Accept incoming connection
-        print(f"Connected to {addr}")  # Log the connection
-        client_thread = threading.Thread(target=handle_client, args=(client_socket,))  # Create a new thread for the client
-        client_thread.daemon = True  # Set thread as daemon so it exits when main thread exits
-        client_thread.start()  # Start the client thread
-    except KeyboardInterrupt:  # Handle manual server shutdown (Ctrl+C)
-        print("Server shutting down...")  # Log shutdown
-        break  # Exit the loop
-    except Exception as e:  # Handle other exceptions
-        print(f"Error accepting connection: {e}")  # Log the error
+try:
+    asyncio.run(main())  # Run the event loop until the server stops
+except KeyboardInterrupt:  # Handle manual server shutdown (Ctrl+C)
+    log.info("Server shutting down...")  # Log shutdown
 
 # Close server
-server.close()  # Close the server socket
+hash_executor.shutdown(wait=True)  # Let any in-flight password hashing finish
+db_executor.shutdown(wait=True)  # Let any in-flight database work finish
+write_queue.put(None)  # Stop the writer once it has committed the queued purchases
+writer_thread.join()
+cursor.execute("PRAGMA optimize")  # Refresh planner statistics if the data has changed enough to matter
 conn.close()  # Close the database connection
-print("Server closed")  # Log server closure
+log.info("Server closed")  # Log server closure